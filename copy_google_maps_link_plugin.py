@@ -1,16 +1,17 @@
 # Import necessary QGIS and Qt modules
-# from qgis.PyQt.QtCore import QCoreApplication # Not directly used
+from math import isfinite
+from qgis.PyQt.QtCore import QObject
 # from qgis.PyQt.QtGui import QIcon # Not used
 from qgis.PyQt.QtWidgets import QAction, QApplication, QMenu
-from qgis.core import QgsProject, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsPointXY, QgsMessageLog, Qgis
-import sip # Import sip to check if Qt objects have been deleted
+from qgis.core import QgsProject, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsPointXY, QgsCsException, QgsMessageLog, Qgis
+
+# Set to True to write info-level messages to the QGIS message log.
+# Warnings and critical messages are always logged.
+_LOG_INFO = False
 
 # This is a common way to store a reference to the QGIS interface
 iface = None
 
-# Global variable to store the clicked point
-clicked_point_canvas_crs = None
-
 def plugin_path():
     """Helper function to get the plugin's directory (optional, but good practice for icons etc.)"""
     import os
@@ -20,6 +21,9 @@ class CopyGoogleMapsLinkPlugin:
     """
     This class defines the QGIS plugin.
     """
+    # Google Maps link prefix; the clicked point is appended as "lat,lon"
+    _URL_PREFIX = "https://www.google.com/maps?q="
+
     def __init__(self, qgis_iface):
         """
         Constructor.
@@ -38,7 +42,30 @@ class CopyGoogleMapsLinkPlugin:
         self.context_menu_action = QAction("Copy Google Maps Link Here", self.canvas)
         self.context_menu_action.triggered.connect(self.copy_google_maps_link_from_context)
 
-        QgsMessageLog.logMessage(f"{self.plugin_name}: __init__ completed. Action created.", self.plugin_name, Qgis.Info)
+        # Separator action created once as well, so both can be added to the menu in one call.
+        self._separator = QAction(self.canvas)
+        self._separator.setSeparator(True)
+
+        # Target CRS (WGS 84 for Google Maps) and a cache of transforms keyed by the
+        # source CRS, so the PROJ pipeline is only built once per canvas CRS.
+        self._target_crs = QgsCoordinateReferenceSystem.fromEpsgId(4326)
+        if not self._target_crs.isValid():
+            QgsMessageLog.logMessage("Failed to initialize EPSG:4326.", self.plugin_name, Qgis.Critical)
+        self._transform_cache = {}
+        self._project = QgsProject.instance()
+
+        # (x, y) of the last right-click in canvas CRS, set when the context menu is shown
+        self._clicked_xy = None
+
+        # Connection handle for contextMenuAboutToShow, set in initGui and used to disconnect in unload
+        self._conn = None
+
+        # Connection handles for the signals that make cached transforms stale
+        self._crs_conn = None
+        self._transform_context_conn = None
+
+        if _LOG_INFO:
+            QgsMessageLog.logMessage(f"{self.plugin_name}: __init__ completed. Action created.", self.plugin_name, Qgis.Info)
 
 
     def initGui(self):
@@ -49,9 +76,41 @@ class CopyGoogleMapsLinkPlugin:
         # Connect to the canvas's contextMenuAboutToShow signal.
         # This signal is emitted just before the context menu is shown, allowing
         # us to add our custom action to it.
-        self.canvas.contextMenuAboutToShow.connect(self.prepare_canvas_context_menu)
+        self._conn = self.canvas.contextMenuAboutToShow.connect(self.prepare_canvas_context_menu)
 
-        QgsMessageLog.logMessage(f"{self.plugin_name}: initGui completed and signal connected.", self.plugin_name, Qgis.Info)
+        # Drop cached transforms when the canvas CRS or the project's transform context changes,
+        # so they are rebuilt on next use instead of being re-checked on every click.
+        self._crs_conn = self.canvas.destinationCrsChanged.connect(self._invalidate_transform_cache)
+        self._transform_context_conn = self._project.transformContextChanged.connect(self._invalidate_transform_cache)
+
+        if _LOG_INFO:
+            QgsMessageLog.logMessage(f"{self.plugin_name}: initGui completed and signal connected.", self.plugin_name, Qgis.Info)
+
+
+    def _invalidate_transform_cache(self):
+        """
+        Called when the canvas CRS or the project transform context changes.
+        Clears the cached transforms so they are rebuilt for the new settings.
+        """
+        self._transform_cache.clear()
+
+
+    def _get_or_build_transform(self, canvas_crs):
+        """
+        Returns the cached transformation from canvas_crs to WGS 84, creating it on first use.
+        The CRS is only validated when a new transformation has to be built.
+        Returns None if the CRS is invalid.
+        """
+        key = canvas_crs.authid() or canvas_crs.toWkt()
+        transform = self._transform_cache.get(key)
+        if transform is None:
+            if not canvas_crs.isValid():
+                iface.messageBar().pushMessage("Error", "Invalid Canvas CRS. Cannot perform transformation.", level=Qgis.Critical, duration=5)
+                QgsMessageLog.logMessage(f"Invalid Canvas CRS: {canvas_crs.authid()}", self.plugin_name, Qgis.Critical)
+                return None
+            transform = QgsCoordinateTransform(canvas_crs, self._target_crs, self._project)
+            self._transform_cache[key] = transform
+        return transform
 
 
     def prepare_canvas_context_menu(self, menu, event):
@@ -61,18 +120,20 @@ class CopyGoogleMapsLinkPlugin:
         'menu' is the QMenu object for the context menu.
         'event' is a QgsMapMouseEvent which contains the clicked point.
         """
-        global clicked_point_canvas_crs
-        if event and event.mapPoint(): # Ensure event and mapPoint are valid
-            # Store the clicked point in the map's current Coordinate Reference System (CRS)
-            clicked_point_canvas_crs = QgsPointXY(event.mapPoint())
-            # QgsMessageLog.logMessage(f"Clicked point (Canvas CRS): {clicked_point_canvas_crs.toString()}", self.plugin_name, Qgis.Info)
-
-            # Add our pre-existing action to the menu.
-            # No need to create or re-parent it here as it's managed by the plugin instance
+        map_point = event.mapPoint() if event else None
+        if map_point: # Ensure event and mapPoint are valid
+            # Store the clicked coordinates in the map's current Coordinate Reference System (CRS).
+            # Only the two floats are kept; a QgsPointXY is built later if the action is actually used.
+            self._clicked_xy = (map_point.x(), map_point.y())
+            if _LOG_INFO:
+                QgsMessageLog.logMessage(f"Clicked point (Canvas CRS): {self._clicked_xy}", self.plugin_name, Qgis.Info)
+
+            # Add our pre-existing separator and action to the menu in a single batched call.
+            # No need to create or re-parent them here as they're managed by the plugin instance
             # and parented to the canvas.
-            menu.addSeparator()
-            menu.addAction(self.context_menu_action)
-            # QgsMessageLog.logMessage(f"{self.plugin_name}: Action added to context menu.", self.plugin_name, Qgis.Info)
+            menu.addActions([self._separator, self.context_menu_action])
+            if _LOG_INFO:
+                QgsMessageLog.logMessage(f"{self.plugin_name}: Action added to context menu.", self.plugin_name, Qgis.Info)
         else:
             QgsMessageLog.logMessage(f"{self.plugin_name}: prepare_canvas_context_menu called without a valid event or mapPoint.", self.plugin_name, Qgis.Warning)
 
@@ -80,63 +141,56 @@ class CopyGoogleMapsLinkPlugin:
     def copy_google_maps_link_from_context(self):
         """
         This function is called when the context menu action is triggered.
-        It uses the globally stored clicked_point_canvas_crs.
+        It uses the clicked point stored by prepare_canvas_context_menu.
         """
-        global clicked_point_canvas_crs
-        if not clicked_point_canvas_crs:
+        # Take the stored clicked point and clear it straight away, so it is only used once
+        # whichever way this function returns.
+        clicked_xy = self._clicked_xy
+        self._clicked_xy = None
+        if not clicked_xy:
             iface.messageBar().pushMessage("Error", "Could not get clicked point. Please right-click on the map again.", level=Qgis.Critical, duration=4)
-            QgsMessageLog.logMessage("copy_google_maps_link_from_context: clicked_point_canvas_crs is None.", self.plugin_name, Qgis.Warning)
+            QgsMessageLog.logMessage("copy_google_maps_link_from_context: self._clicked_xy is None.", self.plugin_name, Qgis.Warning)
             return
 
-        try:
-            # Get the current map canvas Coordinate Reference System (CRS)
-            canvas_crs = self.canvas.mapSettings().destinationCrs()
-            if not canvas_crs.isValid():
-                iface.messageBar().pushMessage("Error", "Invalid Canvas CRS. Cannot perform transformation.", level=Qgis.Critical, duration=5)
-                QgsMessageLog.logMessage(f"Invalid Canvas CRS: {canvas_crs.authid()}", self.plugin_name, Qgis.Critical)
-                clicked_point_canvas_crs = None # Clear invalid point state
-                return
+        # Get the current map canvas Coordinate Reference System (CRS)
+        canvas_crs = self.canvas.mapSettings().destinationCrs()
 
-            # Define the target CRS (WGS 84 for Google Maps)
-            target_crs = QgsCoordinateReferenceSystem("EPSG:4326")
-            if not target_crs.isValid():
-                iface.messageBar().pushMessage("Error", "Could not define target CRS (EPSG:4326).", level=Qgis.Critical, duration=5)
-                QgsMessageLog.logMessage("Failed to initialize EPSG:4326.", self.plugin_name, Qgis.Critical)
-                clicked_point_canvas_crs = None # Clear invalid point state
+        if canvas_crs.authid() == "EPSG:4326" or canvas_crs == self._target_crs:
+            # Canvas is already in WGS 84, no transformation needed
+            lon, lat = clicked_xy
+        else:
+            transform = self._get_or_build_transform(canvas_crs)
+            if transform is None:
                 return
 
-            # Create a coordinate transformation object
-            transform = QgsCoordinateTransform(canvas_crs, target_crs, QgsProject.instance())
-
-            # Transform the point from the canvas CRS to WGS 84
-            point_wgs84 = transform.transform(clicked_point_canvas_crs)
-
-            # Check if transformation was successful and coordinates are valid
-            if not (point_wgs84.x() == point_wgs84.x() and point_wgs84.y() == point_wgs84.y()) or \
-               abs(point_wgs84.x()) == float('inf') or abs(point_wgs84.y()) == float('inf') or \
-               not (-90 <= point_wgs84.y() <= 90 and -180 <= point_wgs84.x() <= 180):
-                 iface.messageBar().pushMessage("Error", "Coordinate transformation failed or resulted in invalid WGS84 coordinates. Check project CRS.", level=Qgis.Critical, duration=5)
-                 QgsMessageLog.logMessage(f"Coordinate transformation resulted in invalid WGS84. Original: {clicked_point_canvas_crs.toString()}, Canvas CRS: {canvas_crs.authid()}, Transformed: {point_wgs84.toString()}", self.plugin_name, Qgis.Critical)
-                 clicked_point_canvas_crs = None
-                 return
+            # Transform the point from the canvas CRS to WGS 84.
+            # This is the only step expected to fail, with a QgsCsException.
+            try:
+                point_wgs84 = transform.transform(QgsPointXY(*clicked_xy))
+            except QgsCsException as e:
+                error_message = f"Error copying Google Maps link: {str(e)}"
+                iface.messageBar().pushMessage("Error", error_message, level=Qgis.Critical, duration=5)
+                QgsMessageLog.logMessage(error_message, self.plugin_name, Qgis.Critical)
+                return
+            lon = point_wgs84.x()
+            lat = point_wgs84.y()
 
-            # Create the Google Maps link (lat,lon format)
-            google_maps_link = f"https://www.google.com/maps?q={point_wgs84.y()},{point_wgs84.x()}"
+        # Check if transformation was successful and coordinates are valid
+        if not (isfinite(lon) and isfinite(lat) and -90 <= lat <= 90 and -180 <= lon <= 180):
+            iface.messageBar().pushMessage("Error", "Coordinate transformation failed or resulted in invalid WGS84 coordinates. Check project CRS.", level=Qgis.Critical, duration=5)
+            QgsMessageLog.logMessage(f"Coordinate transformation resulted in invalid WGS84. Original: {clicked_xy[0]},{clicked_xy[1]}, Canvas CRS: {canvas_crs.authid()}, Transformed: {lon},{lat}", self.plugin_name, Qgis.Critical)
+            return
 
-            # Copy the generated link to the system clipboard
-            clipboard = QApplication.clipboard()
-            clipboard.setText(google_maps_link)
+        # Create the Google Maps link (lat,lon format, 7 decimal places is ~1 cm)
+        google_maps_link = f"{self._URL_PREFIX}{lat:.7f},{lon:.7f}"
 
-            iface.messageBar().pushMessage("Success", f"Google Maps link copied: {google_maps_link}", level=Qgis.Success, duration=5)
-            # QgsMessageLog.logMessage(f"Copied link: {google_maps_link}", self.plugin_name, Qgis.Info)
+        # Copy the generated link to the system clipboard
+        clipboard = QApplication.clipboard()
+        clipboard.setText(google_maps_link)
 
-        except Exception as e:
-            error_message = f"Error copying Google Maps link: {str(e)}"
-            iface.messageBar().pushMessage("Error", error_message, level=Qgis.Critical, duration=5)
-            QgsMessageLog.logMessage(error_message, self.plugin_name, Qgis.Critical)
-        finally:
-            # Clear the globally stored clicked point after use.
-            clicked_point_canvas_crs = None
+        iface.messageBar().pushMessage("Success", f"Google Maps link copied: {google_maps_link}", level=Qgis.Success, duration=5)
+        if _LOG_INFO:
+            QgsMessageLog.logMessage(f"Copied link: {google_maps_link}", self.plugin_name, Qgis.Info)
 
 
     def unload(self):
@@ -145,15 +199,22 @@ class CopyGoogleMapsLinkPlugin:
         It's used to clean up resources, such as disconnecting signals
         and deleting objects created by the plugin.
         """
-        # Disconnect the signal connected in initGui
-        try:
-            if self.canvas: # Ensure canvas object still exists
-                self.canvas.contextMenuAboutToShow.disconnect(self.prepare_canvas_context_menu)
+        import sip # Imported here as it's only needed to check if Qt objects have been deleted
+
+        # Disconnect the signal connected in initGui using its stored connection handle.
+        # The handle is cleared afterwards, so a repeated unload is a no-op.
+        if self._conn:
+            QObject.disconnect(self._conn)
+            self._conn = None
+            if _LOG_INFO:
                 QgsMessageLog.logMessage(f"{self.plugin_name}: Disconnected from contextMenuAboutToShow.", self.plugin_name, Qgis.Info)
-        except TypeError: # Can occur if it was never connected or already disconnected
-            QgsMessageLog.logMessage(f"{self.plugin_name}: Signal (contextMenuAboutToShow) was already disconnected or not connected.", self.plugin_name, Qgis.Warning)
-        except Exception as e: # Catch any other unexpected errors
-            QgsMessageLog.logMessage(f"Error disconnecting signal in unload: {str(e)}", self.plugin_name, Qgis.Warning)
+
+        if self._crs_conn:
+            QObject.disconnect(self._crs_conn)
+            self._crs_conn = None
+        if self._transform_context_conn:
+            QObject.disconnect(self._transform_context_conn)
+            self._transform_context_conn = None
 
         # Clean up the QAction
         if self.context_menu_action:
@@ -161,12 +222,22 @@ class CopyGoogleMapsLinkPlugin:
             # This prevents a RuntimeError if it has already been deleted (e.g., by its parent canvas).
             if not sip.isdeleted(self.context_menu_action):
                 self.context_menu_action.deleteLater()
-                QgsMessageLog.logMessage(f"{self.plugin_name}: Context menu action scheduled for deletion.", self.plugin_name, Qgis.Info)
-            else:
+                if _LOG_INFO:
+                    QgsMessageLog.logMessage(f"{self.plugin_name}: Context menu action scheduled for deletion.", self.plugin_name, Qgis.Info)
+            elif _LOG_INFO:
                 QgsMessageLog.logMessage(f"{self.plugin_name}: Context menu action was already deleted (likely by parent).", self.plugin_name, Qgis.Info)
             self.context_menu_action = None # Clear the Python reference
 
-        QgsMessageLog.logMessage(f"{self.plugin_name}: Unloaded successfully.", self.plugin_name, Qgis.Info)
+        # Clean up the separator action the same way
+        if self._separator:
+            if not sip.isdeleted(self._separator):
+                self._separator.deleteLater()
+            self._separator = None
+
+        self._transform_cache.clear()
+
+        if _LOG_INFO:
+            QgsMessageLog.logMessage(f"{self.plugin_name}: Unloaded successfully.", self.plugin_name, Qgis.Info)
 
 
 # Standard QGIS plugin functions: